@@ -1,7 +1,13 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import polars as pl
+import pyarrow as pa
 import plotly.express as px
+import glob
+import hashlib
+import os
+import re
 import warnings
 
 # Suppress warnings that might clutter the terminal during calculations
@@ -10,15 +16,77 @@ warnings.filterwarnings('ignore')
 # --- 1. CONFIGURATION & DATA LOADING ---
 st.set_page_config(layout="wide", page_title="NexGen GreenRoute Dashboard 🌿")
 
+# The 5 core source files and the on-disk cache of the merged result
+SOURCE_FILES = ["orders.csv", "routes_distance.csv", "vehicle_fleet.csv",
+                "delivery_performance.csv", "cost_breakdown.csv"]
+CACHE_DIR = ".cache"
+# Part of the cache key: bump whenever the columns or dtypes of the merged dataset change,
+# so Parquet files written by older code are not served to the dashboard
+CACHE_SCHEMA_VERSION = 4
+# Columns the dashboard relies on and the dtype it expects for each. A cached frame
+# must contain the required ones, and any optional ones it has must match too.
+CACHE_REQUIRED_DTYPES = {
+    'route_id': 'category', 'vehicle_type': 'category',
+    'total_co2_kg': 'float32', 'carbon_cost_per_value': 'float32',
+}
+CACHE_OPTIONAL_DTYPES = {
+    'priority': 'category', 'age_years': 'float32',
+    'fuel_labor_maintenance_costs_inr': 'float32', 'date_key': 'datetime64[ns]',
+}
+# Fixed seed so the random route/vehicle assignment is reproducible across reloads
+RANDOM_SEED = 0
+# Translation table that deletes currency symbols and thousands separators
+CURRENCY_STRIP_TABLE = str.maketrans('', '', '$, ')
+# Common variations of the Order ID column name found across the files
+ORDER_ID_ALIASES = ('order_id', 'orderid', 'order_id_')
+# Runs of non-alphanumeric characters (except underscore) in a lowercased column name
+COLUMN_CLEAN_RE = re.compile(r'[^a-z0-9_]+')
+
+# Columns used downstream, parsed with explicit dtypes. Keys are cleaned column names
+# (see clean_column_name). Order text fields stay 'str' so blanks can be filled with 0;
+# downcast_dataframe turns them into categoricals after the merge.
+CSV_DTYPES = {
+    "orders.csv": {
+        'order_id': 'str', 'order_date': 'str', 'priority': 'str',
+        'order_value_inr': 'str', 'origin': 'str',
+    },
+    "routes_distance.csv": {'route_id': 'str', 'distance_km': 'float32'},
+    "vehicle_fleet.csv": {
+        'vehicle_type': 'category', 'age_years': 'float32', 'co2_emissions_kg_per_km': 'float32',
+    },
+    "delivery_performance.csv": {'order_id': 'str', 'delivery_cost_inr': 'float32'},
+    "cost_breakdown.csv": {'order_id': 'str', 'fuel_labor_maintenance_costs_inr': 'float32'},
+}
+# Header variants accepted for a CSV_DTYPES column, matching the renames applied after loading
+CSV_COLUMN_ALIASES = {
+    'order_id': ORDER_ID_ALIASES[1:] + ('id',),
+    'order_date': ('order_dat',),
+    'origin': ('origins',),
+    'route_id': ('route',),
+    'fuel_labor_maintenance_costs_inr': ('fuel_labor_maintenance_costs',),
+}
+# Polars parse types for the CSV_DTYPES entries; categoricals are parsed as strings and
+# converted by pandas so their categories come out sorted
+POLARS_DTYPES = {'str': pl.String, 'category': pl.String, 'float32': pl.Float32}
+# Last-resort matches for columns whose header only follows a loose naming pattern
+CSV_COLUMN_FALLBACKS = {
+    'order_value_inr': lambda col: 'order_value' in col and 'inr' in col,
+    'fuel_labor_maintenance_costs_inr': lambda col: 'labor' in col or 'fuel' in col,
+}
+
+def clean_column_name(col):
+    """
+    Strips whitespace, lowercases, and replaces non-alphanumeric characters
+    (except underscore) with an underscore.
+    """
+    return COLUMN_CLEAN_RE.sub('_', str(col).strip().lower()).strip('_')
+
 def clean_and_standardize_columns(df):
     """
     Cleans column names by stripping whitespace, lowercasing, and replacing 
     spaces/special characters with underscores. This ensures consistent merge keys.
     """
-    df.columns = df.columns.astype(str).str.strip()
-    df.columns = df.columns.str.lower()
-    # Replace non-alphanumeric characters (except underscore) with an underscore
-    df.columns = df.columns.str.replace('[^a-z0-9_]+', '_', regex=True).str.strip('_')
+    df.columns = [clean_column_name(col) for col in df.columns]
     return df
 
 def standardize_order_id(df, target_name='id'):
@@ -26,33 +94,149 @@ def standardize_order_id(df, target_name='id'):
     Finds and renames the Order ID column to the merge key 'id'. 
     Applies to orders_df, cost_df, and performance_df.
     """
-    # Includes common variations found across the files
-    possible_id_names = ['order_id', 'orderid', 'order_id_'] 
-    
-    for name in possible_id_names:
-        if name in df.columns:
-            df.rename(columns={name: target_name}, inplace=True)
-            return True 
-    
-    if target_name in df.columns:
-        return True
+    cols = set(df.columns)
+    source_name = next((name for name in ORDER_ID_ALIASES if name in cols), None)
+    if source_name is not None:
+        df.rename(columns={source_name: target_name}, inplace=True)
+    return source_name is not None or target_name in cols
+
+def downcast_dataframe(df, category_ratio=0.5):
+    """
+    Shrinks the merged DataFrame before it is cached: floats become float32, integers
+    the smallest safe integer type, and repetitive text columns become categoricals.
+    """
+    for col in df.select_dtypes(include='float64').columns:
+        df[col] = df[col].astype('float32')
+    for col in df.select_dtypes(include='integer').columns:
+        downcast = 'unsigned' if (df[col] >= 0).all() else 'integer'
+        df[col] = pd.to_numeric(df[col], downcast=downcast)
     
-    return False 
+    # Text columns are cast to str first: fillna(0) can leave mixed text/0 values,
+    # which Parquet can't store
+    for col in df.select_dtypes(include=['object', 'string']).columns:
+        df[col] = df[col].astype(str)
+        if len(df) and df[col].nunique() / len(df) < category_ratio:
+            df[col] = df[col].astype('category')
+    return df
+
+def derive_co2_metrics(distance, co2_factor, order_value):
+    """
+    Computes Total CO₂ (kg) and Carbon Cost Per Value from float32 arrays. Both output
+    arrays are allocated once and filled in place; orders without a positive value
+    get a CCPV of 0 instead of inf/NaN.
+    """
+    total_co2 = np.empty_like(distance)
+    np.multiply(distance, co2_factor, out=total_co2)
+    carbon_cost_per_value = np.zeros_like(total_co2)
+    np.divide(total_co2, order_value, out=carbon_cost_per_value, where=order_value > 0)
+    return total_co2, carbon_cost_per_value
+
+def get_parquet_cache_path():
+    """
+    Builds the Parquet cache file path for the merged dataset. The file name is keyed
+    on the newest source CSV mtime and CACHE_SCHEMA_VERSION, so editing any CSV or
+    changing the dataset's schema invalidates the cache.
+    """
+    latest_mtime = max(os.stat(path).st_mtime_ns for path in SOURCE_FILES)
+    key_source = f"{CACHE_SCHEMA_VERSION}:{latest_mtime}"
+    cache_key = hashlib.md5(key_source.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"df_final_{cache_key}.parquet")
+
+def is_valid_cached_frame(df):
+    """
+    Checks that a frame read from the Parquet cache has the columns and dtypes the
+    dashboard expects, so a stale or foreign cache file is rebuilt instead of used.
+    """
+    for col, dtype in CACHE_REQUIRED_DTYPES.items():
+        if col not in df.columns or str(df[col].dtype) != dtype:
+            return False
+    return all(str(df[col].dtype) == dtype for col, dtype in CACHE_OPTIONAL_DTYPES.items()
+               if col in df.columns)
+
+def write_parquet_cache(df, cache_path):
+    """
+    Writes the merged dataset to the Parquet cache and removes the files left by
+    earlier CSV versions. The file is written under a temporary name and moved into
+    place, so an interrupted write never leaves a truncated file at the cache path.
+    A read-only directory just skips the cache.
+    """
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(tmp_path, engine='pyarrow', compression='zstd')
+        os.replace(tmp_path, cache_path)
+        for old_path in glob.glob(os.path.join(CACHE_DIR, "df_final_*.parquet")):
+            if os.path.abspath(old_path) != os.path.abspath(cache_path):
+                os.remove(old_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def read_parquet_cache(cache_path):
+    """
+    Returns the cached merged dataset, or None when there is no usable cache file:
+    missing, unreadable (e.g. truncated), or not matching the expected schema.
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        cached_df = pd.read_parquet(cache_path, engine='pyarrow')
+    except (OSError, pa.ArrowException):
+        return None
+    return cached_df if is_valid_cached_frame(cached_df) else None
+
+def resolve_source_dtypes(path, headers):
+    """
+    Matches the raw headers of one core CSV against CSV_DTYPES by cleaned name, trying
+    the exact name, then CSV_COLUMN_ALIASES, then CSV_COLUMN_FALLBACKS. Returns the
+    explicit dtype for each matched raw header; columns that aren't found are simply
+    left out and handled by the checks after loading.
+    """
+    cleaned = {clean_column_name(header): header for header in headers}
+    raw_dtypes = {}
+    for name, dtype in CSV_DTYPES[path].items():
+        candidates = (name,) + CSV_COLUMN_ALIASES.get(name, ())
+        match = next((cleaned[c] for c in candidates if c in cleaned), None)
+        if match is None and name in CSV_COLUMN_FALLBACKS:
+            match = next((header for col, header in cleaned.items()
+                          if CSV_COLUMN_FALLBACKS[name](col)), None)
+        if match is not None and match not in raw_dtypes:
+            raw_dtypes[match] = dtype
+    return raw_dtypes
+
+def read_source_csvs(paths):
+    """
+    Parses all the given CSVs in one multi-threaded Polars run and hands them over as
+    pandas DataFrames. Every column is kept (the CSV export includes them all); the
+    columns resolved from CSV_DTYPES get their explicit dtypes, the rest are inferred.
+    Headers keep their original names for the cleaning steps.
+    """
+    raw_dtypes = [resolve_source_dtypes(path, pl.scan_csv(path, infer_schema=False).collect_schema().names())
+                  for path in paths]
+    scans = [
+        pl.scan_csv(path, schema_overrides={col: POLARS_DTYPES[dtype] for col, dtype in dtypes.items()})
+        for path, dtypes in zip(paths, raw_dtypes)
+    ]
+    frames = pl.collect_all(scans)
+    return [frame.to_pandas().astype(dtypes) for frame, dtypes in zip(frames, raw_dtypes)]
 
 @st.cache_data
 def load_and_merge_data():
     """
     Loads, cleans, standardizes all column names, and merges the 5 core datasets
-    for the Sustainability Tracker (Option 7).
+    for the Sustainability Tracker (Option 7). Returns the merged DataFrame together
+    with its data version (the Parquet cache path), which keys the dashboard caches.
     """
     st.info("Loading, standardizing, and processing data...")
     try:
+        # Reuse the merged dataset from a previous session if the CSVs haven't changed
+        cache_path = get_parquet_cache_path()
+        cached_df = read_parquet_cache(cache_path)
+        if cached_df is not None:
+            return cached_df, cache_path
+
         # Load necessary dataframes 
-        orders_df = pd.read_csv("orders.csv")
-        routes_df = pd.read_csv("routes_distance.csv")
-        fleet_df = pd.read_csv("vehicle_fleet.csv")
-        performance_df = pd.read_csv("delivery_performance.csv")
-        cost_df = pd.read_csv("cost_breakdown.csv")
+        orders_df, routes_df, fleet_df, performance_df, cost_df = read_source_csvs(SOURCE_FILES)
         
         # 1. Apply universal cleaning to all DataFrames
         orders_df = clean_and_standardize_columns(orders_df)
@@ -66,12 +250,16 @@ def load_and_merge_data():
             if not standardize_order_id(df):
                  # This error indicates a failure to find the ID column for merging
                  raise KeyError("Missing 'id' key after rename attempt in a primary DataFrame.")
+        
+        # Keep the first cost row per order, hashing only the key column
+        cost_df = cost_df.loc[~cost_df['id'].duplicated(keep='first')].reset_index(drop=True)
 
         # Ensure the Fuel/Labor/Maintenance cost column name is finalized for KPI calculation.
         if 'fuel_labor_maintenance_costs' in cost_df.columns:
              cost_df.rename(columns={'fuel_labor_maintenance_costs': 'fuel_labor_maintenance_costs_inr'}, inplace=True)
         elif 'fuel_labor_maintenance_costs_inr' not in cost_df.columns:
-            possible_cost_cols = [col for col in cost_df.columns if 'labor' in col or 'fuel' in col]
+            is_cost_col = CSV_COLUMN_FALLBACKS['fuel_labor_maintenance_costs_inr']
+            possible_cost_cols = [col for col in cost_df.columns if is_cost_col(col)]
             if possible_cost_cols:
                 cost_df.rename(columns={possible_cost_cols[0]: 'fuel_labor_maintenance_costs_inr'}, inplace=True)
 
@@ -81,68 +269,98 @@ def load_and_merge_data():
         
         # 3. Handle currency strings and convert Order Value to numeric
         # We assume 'order_value_inr' is the original column name before cleaning:
-        order_value_col = [col for col in orders_df.columns if 'order_value' in col and 'inr' in col]
+        order_value_col = [col for col in orders_df.columns if CSV_COLUMN_FALLBACKS['order_value_inr'](col)]
         if order_value_col:
-            orders_df['order_value_cleaned'] = (
-                orders_df[order_value_col[0]]
-                .astype(str)
-                .str.replace('$', '', regex=False)
-                .str.replace(',', '', regex=False)
-            )
-            orders_df['order_value_usd'] = pd.to_numeric(orders_df['order_value_cleaned'], errors='coerce').fillna(0)
+            # Strip '$', ',' and spaces in a single pass over each string
+            order_value_str = orders_df[order_value_col[0]].astype('string').str.translate(CURRENCY_STRIP_TABLE)
+            orders_df['order_value_usd'] = pd.to_numeric(order_value_str, errors='coerce').fillna(0).astype('float32')
         else:
             orders_df['order_value_usd'] = 0 # Default if the source column is missing
         
         # --- Merging Sequence ---
         
+        # Index each table once on its join key so every link below is an index join
+        orders_df = orders_df.set_index('id')
+        performance_df = performance_df.set_index('id')
+        cost_df = cost_df.set_index('id')
+
         # Link 1: Orders with Performance (key: 'id')
-        df_merged = pd.merge(orders_df, performance_df, on='id', how='left')
+        df_merged = orders_df.join(performance_df, how='left', validate='m:1')
         
+        rng = np.random.default_rng(RANDOM_SEED)
+
         # Link 2: Route Assignment and Metrics
         if 'route_id' not in df_merged.columns:
-             route_keys = routes_df['route_id'].unique()
+             # Share one categorical dtype on both sides so the join matches on integer codes
+             # Blank routes can't be categories; sorted categories keep the groupby order stable
+             route_dtype = pd.CategoricalDtype(sorted(routes_df['route_id'].dropna().unique()))
+             routes_df['route_id'] = routes_df['route_id'].astype(route_dtype)
              # Randomly assign a route if the column is missing after merging orders/performance (as a fallback)
-             df_merged['route_id'] = np.random.choice(route_keys, size=len(df_merged))
+             route_codes = rng.integers(0, len(route_dtype.categories), size=len(df_merged))
+             df_merged['route_id'] = pd.Categorical.from_codes(route_codes, dtype=route_dtype)
         
         # Drop 'id' from routes_df if it exists to prevent merge conflicts.
         if 'id' in routes_df.columns:
             routes_df = routes_df.drop(columns=['id'])
             
-        df_merged = pd.merge(df_merged, routes_df, on='route_id', how='left', suffixes=('_order', '_route'))
+        df_merged = df_merged.join(routes_df.set_index('route_id'), on='route_id', how='left',
+                                   lsuffix='_order', rsuffix='_route')
         df_merged = df_merged.rename(columns={'distance_km_route': 'distance_km'}) 
 
         # Link 3: Vehicle Assignment and CO2 Factors
-        vehicle_types = fleet_df['vehicle_type'].unique()
-        df_merged['assigned_vehicle_type'] = np.random.choice(vehicle_types, size=len(df_merged))
+        fleet_df['vehicle_type'] = fleet_df['vehicle_type'].astype('category')
+        vehicle_dtype = fleet_df['vehicle_type'].dtype
+        vehicle_codes = rng.integers(0, len(vehicle_dtype.categories), size=len(df_merged))
+        df_merged['vehicle_type'] = pd.Categorical.from_codes(vehicle_codes, dtype=vehicle_dtype)
         
-        df_final = pd.merge(df_merged, fleet_df, left_on='assigned_vehicle_type', 
-                             right_on='vehicle_type', how='left', suffixes=('_merge', '_fleet'))
+        # Only the CO2 factor and age are needed downstream, so map per-type averages onto the
+        # assignment instead of joining every fleet column (one row per vehicle of that type)
+        fleet_factors = fleet_df.groupby('vehicle_type', observed=True)[['co2_emissions_kg_per_km', 'age_years']].mean()
+        df_final = df_merged
+        for col in fleet_factors.columns:
+            df_final[col] = df_final['vehicle_type'].map(fleet_factors[col].to_dict()).astype('float32')
 
-        # Link 4: Add Cost Breakdown (key: 'id')
-        cost_cols_to_merge = [col for col in cost_df.columns if col != 'id']
-        cost_cols_to_merge.insert(0, 'id')
-        
-        df_final = pd.merge(df_final, cost_df[cost_cols_to_merge].drop_duplicates(subset=['id']), 
-                            on='id', how='left', suffixes=('_final', '_cost'))
+        # Link 4: Add Cost Breakdown (key: 'id'), already deduplicated at load
+        df_final = df_final.join(cost_df, how='left', lsuffix='_final', rsuffix='_cost', validate='m:1')
+        df_final = df_final.reset_index()
         
         # --- DERIVED METRICS ---
         
         # 1. Total CO2 (kg) calculation
         co2_column_name = 'co2_emissions_kg_per_km' 
         
-        # Impute missing distance and CO2 factors with the mean
-        df_final['distance_km'] = df_final['distance_km'].fillna(df_final['distance_km'].mean())
-        df_final[co2_column_name] = df_final[co2_column_name].fillna(df_final[co2_column_name].mean())
-        
-        df_final['total_co2_kg'] = df_final['distance_km'] * df_final[co2_column_name]
+        # Impute missing distance and CO2 factors with the mean, working on raw float32 arrays
+        distance = df_final['distance_km'].to_numpy(dtype='float32', copy=True)
+        co2_factor = df_final[co2_column_name].to_numpy(dtype='float32', copy=True)
+        np.copyto(distance, np.nanmean(distance), where=np.isnan(distance))
+        np.copyto(co2_factor, np.nanmean(co2_factor), where=np.isnan(co2_factor))
+        df_final['distance_km'] = distance
+        df_final[co2_column_name] = co2_factor
         
-        # 2. Innovative Derived Metric: Carbon Cost Per Value (CCPV)
-        df_final['carbon_cost_per_value'] = df_final['total_co2_kg'] / df_final['order_value_usd']
+        # 2. Total CO2 and the Innovative Derived Metric: Carbon Cost Per Value (CCPV)
+        order_value = df_final['order_value_usd'].to_numpy(dtype='float32')
+        total_co2, carbon_cost_per_value = derive_co2_metrics(distance, co2_factor, order_value)
+        df_final['total_co2_kg'] = total_co2
+        df_final['carbon_cost_per_value'] = carbon_cost_per_value
         
-        # Handle division by zero/inf and final cleanup
-        df_final['carbon_cost_per_value'] = df_final['carbon_cost_per_value'].replace([np.inf, -np.inf], np.nan).fillna(0)
+        # Categoricals can't take a 0 fill value that isn't one of their categories, so only
+        # the other columns are filled
+        fill_cols = df_final.select_dtypes(exclude='category').columns
+        df_final[fill_cols] = df_final[fill_cols].fillna(0)
+        df_final = downcast_dataframe(df_final)
         
-        return df_final.fillna(0) 
+        # 3. Parse the order date once here instead of on every rerun. Dates are DD-MM-YYYY;
+        # unparseable values become NaT and are skipped by the time series groupby.
+        date_col = 'order_dat' if 'order_dat' in df_final.columns else 'order_date'
+        if date_col in df_final.columns:
+            # Parsing a categorical yields categorical datetimes, so cast to a plain datetime64 column
+            df_final['date_key'] = pd.to_datetime(df_final[date_col], errors='coerce', format='mixed',
+                                                  dayfirst=True, cache=True).astype('datetime64[ns]')
+
+        # Persist for cross-session reuse
+        write_parquet_cache(df_final, cache_path)
+
+        return df_final, cache_path
 
     except FileNotFoundError:
         st.error("🚨 Error: One or more CSV files were not found. Please ensure all 5 core files are in the same directory as run_app.py.")
@@ -152,8 +370,115 @@ def load_and_merge_data():
         st.error(f"🚨 A fatal error occurred during data processing. Please check column names and file integrity: {e}")
         st.stop()
 
+def category_code_mask(series, value):
+    """
+    Boolean mask of the rows of a categorical Series equal to `value`, compared on
+    the integer category codes rather than the string values.
+    """
+    return series.cat.codes.to_numpy() == series.cat.categories.get_loc(value)
+
+def top_routes_by_co2(df, k):
+    """
+    Returns the k routes with the highest total CO₂, largest first. Sums per route with
+    np.bincount over the Route_ID category codes and selects the top k with
+    np.argpartition, so only the k winners are sorted.
+    """
+    routes = df['Route_ID'].cat.categories
+    codes = df['Route_ID'].cat.codes.to_numpy()
+    valid = codes >= 0
+    codes = codes[valid]
+    weights = df['Total_CO2_kg'].to_numpy(dtype='float64')[valid]
+    sums = np.bincount(codes, weights=weights, minlength=len(routes))
+    
+    # Only routes present in the (filtered) data are candidates
+    observed = np.flatnonzero(np.bincount(codes, minlength=len(routes)))
+    if len(observed) > k:
+        observed = observed[np.argpartition(-sums[observed], k - 1)[:k]]
+    top = observed[np.argsort(-sums[observed], kind='stable')]
+    return pd.DataFrame({'Route_ID': routes[top], 'Total_CO2_kg': sums[top]})
+
+@st.cache_data
+def compute_dashboard_aggregates(_filtered_data, data_version, selected_vehicle, selected_priority):
+    """
+    Computes the KPI values and chart aggregates for one filter selection. The filtered
+    DataFrame is not hashed (leading underscore); results are cached per data version
+    and filter selection, so toggling back to a previous selection is a cache hit.
+    """
+    df = _filtered_data
+    aggregates = {
+        'total_co2_mt': df['Total_CO2_kg'].sum() / 1000, # Metric Tonnes
+        'avg_ccpv': df[df['Carbon_Cost_Per_Value'] > 0]['Carbon_Cost_Per_Value'].mean(),
+        'total_fuel_cost': df['Fuel_Labor_Maintenance_Costs_INR'].sum(),
+        'total_orders': df['ID'].nunique(),
+        'total_routes': df['Route_ID'].nunique(),
+        'route_co2': top_routes_by_co2(df, 10),
+        'fleet_summary': df.groupby('Vehicle_Type', observed=True).agg(
+            Avg_CCPV=('Carbon_Cost_Per_Value', 'mean'),
+            Avg_Age=('Vehicle_Age', 'mean'),
+            Total_CO2=('Total_CO2_kg', 'sum')
+        ).reset_index(),
+        'origin_co2': None,
+        'time_co2': None,
+    }
+    
+    if 'Origins' in df.columns:
+        aggregates['origin_co2'] = df.groupby('Origins', observed=True)['Total_CO2_kg'].sum().reset_index()
+    
+    if 'Date_Key' in df.columns:
+        # Date_Key is parsed at load time; NaTs are dropped by the groupby
+        time_co2 = df['Total_CO2_kg'].groupby(df['Date_Key'].dt.floor('D')).sum().reset_index()
+        time_co2['Date_Key'] = time_co2['Date_Key'].dt.strftime('%Y-%m-%d')
+        aggregates['time_co2'] = time_co2
+    
+    return aggregates
+
+@st.cache_data
+def filtered_data_to_csv_bytes(_filtered_data, data_version, selected_vehicle, selected_priority):
+    """
+    Encodes the filtered data for the download button. Like the aggregates, this is
+    cached per data version and filter selection rather than by hashing the DataFrame.
+    """
+    return _filtered_data.to_csv(index=False, lineterminator='\n').encode('utf-8')
+
+# --- CACHED FIGURE BUILDERS ---
+# The aggregates passed in are small, so hashing them is cheap and a rerun with the same
+# aggregate reuses the built figure instead of rebuilding and re-serializing it.
+
+@st.cache_data
+def make_route_bar(route_co2_analysis):
+    """Bar chart of the top CO₂ emitting routes (VIZ 1)."""
+    return px.bar(route_co2_analysis, x='Route_ID', y='Total_CO2_kg', 
+                   title="Highest CO₂ Emitting Routes",
+                   labels={'Total_CO2_kg': 'CO₂ Emissions (kg)'},
+                   color='Route_ID',
+                   color_discrete_sequence=px.colors.qualitative.Dark24)
+
+@st.cache_data
+def make_fleet_scatter(fleet_summary):
+    """Bubble chart of average CCPV against vehicle age per vehicle type (VIZ 2)."""
+    return px.scatter(fleet_summary, x='Avg_Age', y='Avg_CCPV',
+                       size='Total_CO2', color='Vehicle_Type',
+                       hover_name='Vehicle_Type',
+                       title="Avg. CCPV vs. Vehicle Age (Bubble Size = Total CO₂)",
+                       labels={'Avg_CCPV': 'Avg. CCPV (Lower is Better)', 'Avg_Age': 'Avg. Vehicle Age (Years)'},
+                       color_discrete_sequence=px.colors.qualitative.Safe)
+
+@st.cache_data
+def make_origin_pie(origin_co2):
+    """Pie chart of the CO₂ share per order origin (VIZ 3)."""
+    return px.pie(origin_co2, values='Total_CO2_kg', names='Origins',
+                title="CO₂ Share by Order Origin Warehouse",
+                color_discrete_sequence=px.colors.sequential.Agsunset)
+
+@st.cache_data
+def make_time_line(time_co2):
+    """Line chart of daily total CO₂ emissions (VIZ 4)."""
+    return px.line(time_co2, x='Date_Key', y='Total_CO2_kg', 
+                   title="Daily Total CO₂ Emissions Over Time",
+                   labels={'Date_Key': 'Date', 'Total_CO2_kg': 'CO₂ Emissions (kg)'})
+
 # Load the data and handle potential errors
-data = load_and_merge_data()
+data, data_version = load_and_merge_data()
 
 # --- DASHBOARD LAYOUT & INTERACTIVITY ---
 
@@ -168,7 +493,8 @@ rename_map = {
     'carbon_cost_per_value': 'Carbon_Cost_Per_Value',
     'distance_km': 'Distance_km', 
     'age_years': 'Vehicle_Age',
-    'fuel_labor_maintenance_costs_inr': 'Fuel_Labor_Maintenance_Costs_INR'
+    'fuel_labor_maintenance_costs_inr': 'Fuel_Labor_Maintenance_Costs_INR',
+    'date_key': 'Date_Key'
 }
 
 # --- FIXES FOR COLUMN NAME INCONSISTENCIES ---
@@ -199,40 +525,50 @@ st.markdown("---")
 st.sidebar.header("Filter & Analysis Options")
 if not data.empty:
     
+    # Both filters build one boolean mask over the categorical codes and the data
+    # is sliced once at the end
+    filter_mask = np.ones(len(data), dtype=bool)
+    selected_vehicle = selected_priority = "All"
+    
     # Filter 1: Vehicle Type Selection
     vehicle_col = 'Vehicle_Type'
-    filtered_data = data.copy()
     if vehicle_col in data.columns:
-        vehicle_options = ["All"] + sorted(list(data[vehicle_col].unique()))
+        # Vehicle_Type is categorical, so its (sorted) categories are already the option list
+        vehicle_options = ["All"] + data[vehicle_col].cat.categories.tolist()
         selected_vehicle = st.sidebar.selectbox("Filter by Vehicle Asset", options=vehicle_options)
         if selected_vehicle != "All":
-            filtered_data = filtered_data[filtered_data[vehicle_col] == selected_vehicle]
+            filter_mask &= category_code_mask(data[vehicle_col], selected_vehicle)
     else:
         st.sidebar.warning(f"Vehicle Type column is missing.")
     
     # Filter 2: Priority Level 
     priority_col = 'Priority_Levels'
-    if priority_col in filtered_data.columns:
-        priority_options = ["All"] + sorted(list(filtered_data[priority_col].unique()))
+    if priority_col in data.columns:
+        # Offer only the priorities present under the vehicle filter
+        priority_codes = data[priority_col].cat.codes.to_numpy()
+        present_codes = np.unique(priority_codes[filter_mask & (priority_codes >= 0)])
+        priority_options = ["All"] + data[priority_col].cat.categories[present_codes].tolist()
         selected_priority = st.sidebar.selectbox("Filter by Order Priority", options=priority_options)
         if selected_priority != "All":
-            filtered_data = filtered_data[filtered_data[priority_col] == selected_priority]
+            filter_mask &= category_code_mask(data[priority_col], selected_priority)
     else:
          st.sidebar.warning(f"Priority Levels column is missing.")
     
+    # Only materialize a slice when a filter is active; nothing below mutates filtered_data
+    filtered_data = data if filter_mask.all() else data.iloc[filter_mask]
+    
+    # KPIs and chart aggregates are cached per filter selection and data version,
+    # so edited CSVs invalidate them
+    aggregates = compute_dashboard_aggregates(filtered_data, data_version, selected_vehicle, selected_priority)
+    
     # --- KEY METRICS (KPIs) ---
     col1, col2, col3, col4 = st.columns(4)
 
     # All KPI calculations use the Title Cased column names
-    total_co2_mt = filtered_data['Total_CO2_kg'].sum() / 1000 # Metric Tonnes
-    avg_ccpv = filtered_data[filtered_data['Carbon_Cost_Per_Value'] > 0]['Carbon_Cost_Per_Value'].mean()
-    total_fuel_cost = filtered_data['Fuel_Labor_Maintenance_Costs_INR'].sum()
-    total_orders = len(filtered_data['ID'].unique())
-    
-    col1.metric("Total CO₂ (Metric Tonnes)", f"{total_co2_mt:,.2f} MT")
-    col2.metric("Avg. Carbon Cost Per Value (CCPV)", f"{avg_ccpv:,.5f}", help="CO₂ (kg) spent per unit of Order Value. Lower is better.")
-    col3.metric("Total Routes Analyzed", f"{len(filtered_data['Route_ID'].unique()):,}")
-    col4.metric("Total Fuel/Labor Cost", f"INR {total_fuel_cost:,.0f}")
+    col1.metric("Total CO₂ (Metric Tonnes)", f"{aggregates['total_co2_mt']:,.2f} MT")
+    col2.metric("Avg. Carbon Cost Per Value (CCPV)", f"{aggregates['avg_ccpv']:,.5f}", help="CO₂ (kg) spent per unit of Order Value. Lower is better.")
+    col3.metric("Total Routes Analyzed", f"{aggregates['total_routes']:,}")
+    col4.metric("Total Fuel/Labor Cost", f"INR {aggregates['total_fuel_cost']:,.0f}")
 
     st.markdown("---")
 
@@ -240,12 +576,8 @@ if not data.empty:
     
     # VIZ 1: Bar Chart (CO2 Hotspots)
     st.header("1. CO₂ Hotspot Analysis: Top 10 Routes by Emission (Bar Chart) 📊")
-    route_co2_analysis = filtered_data.groupby('Route_ID')['Total_CO2_kg'].sum().nlargest(10).reset_index()
-    fig1 = px.bar(route_co2_analysis, x='Route_ID', y='Total_CO2_kg', 
-                   title="Highest CO₂ Emitting Routes",
-                   labels={'Total_CO2_kg': 'CO₂ Emissions (kg)'},
-                   color='Route_ID',
-                   color_discrete_sequence=px.colors.qualitative.Dark24)
+    route_co2_analysis = aggregates['route_co2']
+    fig1 = make_route_bar(route_co2_analysis)
     st.plotly_chart(fig1, use_container_width=True)
 
     col_chart_2, col_chart_3 = st.columns(2)
@@ -253,29 +585,17 @@ if not data.empty:
     with col_chart_2:
         # VIZ 2: Scatter Plot (Efficiency vs. Vehicle Age)
         st.subheader("2. Fleet Asset Performance (Scatter Plot) ⚙️")
-        fleet_summary = filtered_data.groupby('Vehicle_Type').agg(
-            Avg_CCPV=('Carbon_Cost_Per_Value', 'mean'),
-            Avg_Age=('Vehicle_Age', 'mean'),
-            Total_CO2=('Total_CO2_kg', 'sum')
-        ).reset_index()
+        fleet_summary = aggregates['fleet_summary']
         
-        fig2 = px.scatter(fleet_summary, x='Avg_Age', y='Avg_CCPV',
-                           size='Total_CO2', color='Vehicle_Type',
-                           hover_name='Vehicle_Type',
-                           title="Avg. CCPV vs. Vehicle Age (Bubble Size = Total CO₂)",
-                           labels={'Avg_CCPV': 'Avg. CCPV (Lower is Better)', 'Avg_Age': 'Avg. Vehicle Age (Years)'},
-                           color_discrete_sequence=px.colors.qualitative.Safe)
+        fig2 = make_fleet_scatter(fleet_summary)
         st.plotly_chart(fig2, use_container_width=True)
 
     with col_chart_3:
         # VIZ 3: Pie Chart (CO2 Distribution by Origin)
         st.subheader("3. CO₂ Distribution by Order Origin (Pie Chart) 🥧")
-        origins_col = 'Origins'
-        if origins_col in filtered_data.columns:
-            origin_co2 = filtered_data.groupby(origins_col)['Total_CO2_kg'].sum().reset_index()
-            fig3 = px.pie(origin_co2, values='Total_CO2_kg', names=origins_col,
-                        title="CO₂ Share by Order Origin Warehouse",
-                        color_discrete_sequence=px.colors.sequential.Agsunset)
+        origin_co2 = aggregates['origin_co2']
+        if origin_co2 is not None:
+            fig3 = make_origin_pie(origin_co2)
             st.plotly_chart(fig3, use_container_width=True)
         else:
             st.warning("Cannot display Pie Chart: 'Origins' column is missing or was filtered out.")
@@ -286,29 +606,21 @@ if not data.empty:
     
     date_column = 'Order_Date'
             
-    if date_column in filtered_data.columns:
-        # Safely convert to datetime and then period
-        filtered_data['Date_Key'] = pd.to_datetime(filtered_data[date_column], errors='coerce').dt.to_period('D')
-        # Drop NaTs that resulted from coercion to avoid errors in groupby
-        time_co2 = filtered_data.dropna(subset=['Date_Key']).groupby('Date_Key')['Total_CO2_kg'].sum().reset_index()
-        time_co2['Date_Key'] = time_co2['Date_Key'].astype(str)
-        
-        fig4 = px.line(time_co2, x='Date_Key', y='Total_CO2_kg', 
-                       title="Daily Total CO₂ Emissions Over Time",
-                       labels={'Date_Key': 'Date', 'Total_CO2_kg': 'CO₂ Emissions (kg)'})
+    time_co2 = aggregates['time_co2']
+    if time_co2 is not None:
+        fig4 = make_time_line(time_co2)
         st.plotly_chart(fig4, use_container_width=True)
     else:
-        # This warning is what we are explicitly fixing by adding 'order_dat' to the rename map.
+        # Date_Key is only built when an 'order_dat'/'order_date' column exists at load time.
         st.warning(f"Cannot display time series data: Date column '{date_column}' not found.")
 
     # --- ACTIONABLE RECOMMENDATIONS (Business Impact) ---
     st.header("5. 💡 Actionable Recommendations & Business Impact")
     
-    # Use the 'data' df for global recommendations
-    full_route_co2 = data.groupby('Route_ID')['Total_CO2_kg'].sum().nlargest(5).index.tolist()
-    full_fleet_summary = data.groupby('Vehicle_Type').agg(
-        Avg_CCPV=('Carbon_Cost_Per_Value', 'mean')
-    ).reset_index()
+    # Use the 'data' df for global recommendations (the cached "All"/"All" aggregates)
+    full_aggregates = compute_dashboard_aggregates(data, data_version, "All", "All")
+    full_route_co2 = full_aggregates['route_co2']['Route_ID'].head(5).astype(str).tolist()
+    full_fleet_summary = full_aggregates['fleet_summary']
     # Safely get the top 3 least efficient vehicles
     least_efficient_vehicles = full_fleet_summary.nlargest(3, 'Avg_CCPV')['Vehicle_Type'].tolist()
 
@@ -330,7 +642,7 @@ if not data.empty:
     
     # --- Download/Export Functionality (Technical Requirement) ---
     st.markdown("---")
-    csv = filtered_data.to_csv(index=False).encode('utf-8')
+    csv = filtered_data_to_csv_bytes(filtered_data, data_version, selected_vehicle, selected_priority)
     st.download_button(
         label="⬇️ Download Filtered Data as CSV (Technical Deliverable)",
         data=csv,
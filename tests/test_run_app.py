@@ -0,0 +1,57 @@
+import csv
+import shutil
+from pathlib import Path
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+SOURCE_FILES = ["orders.csv", "routes_distance.csv", "vehicle_fleet.csv",
+                "delivery_performance.csv", "cost_breakdown.csv"]
+
+
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch):
+    """Copies the app and its CSVs into a scratch directory and runs from there."""
+    # st.cache_data is process-wide, so drop results cached by earlier tests
+    st.cache_data.clear()
+    for name in SOURCE_FILES + ["run_app.py"]:
+        shutil.copy(REPO_DIR / name, tmp_path / name)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def blank_cell(path, column, row=0):
+    """Empties one cell of a CSV file, addressed by header name and data row index."""
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    rows[row + 1][rows[0].index(column)] = ''
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+
+def run_app(app_dir):
+    at = AppTest.from_file(str(app_dir / "run_app.py"), default_timeout=60).run()
+    assert not at.exception
+    assert not at.error, [e.value for e in at.error]
+    return at
+
+
+def test_dashboard_renders(app_dir):
+    at = run_app(app_dir)
+    assert len(at.metric) == 4
+    assert len(at.get("plotly_chart")) == 4
+
+
+@pytest.mark.parametrize("column", ["Origin", "Priority"])
+def test_blank_order_text_field_renders(app_dir, column):
+    blank_cell(app_dir / "orders.csv", column)
+    at = run_app(app_dir)
+    assert len(at.get("plotly_chart")) == 4
+
+
+def test_blank_route_renders(app_dir):
+    blank_cell(app_dir / "routes_distance.csv", "Route")
+    at = run_app(app_dir)
+    assert len(at.get("plotly_chart")) == 4